@@ -42,13 +42,13 @@ def evaluate_model(rgb, extended_feature, filters_extended_fft,
       channels].
     extended_feature: some feature particular to the input image in the shape of
       shape of [batch_size, extended_vector_length].
-    filters_extended_fft: The FFT of stacked 2D filters in the shape of
-      [extended_vector_length, height, width, channels], where the first rank of
-      the tensor must have the same size of weights. The fused filter will be
-      converted into 2D-DFT coefficients for each channel in the later stage of
-      the TF graph. This will be learned.
-    filters_base_fft: The FFT of stacked 2D filters in the shape of [height,
-      width, channels]. This will be learned.
+    filters_extended_fft: The real FFT of stacked 2D filters in the shape of
+      [extended_vector_length, channels, height, width // 2 + 1], where the
+      first rank of the tensor must have the same size of weights. The fused
+      filter will be converted into 2D-DFT coefficients for each channel in the
+      later stage of the TF graph. This will be learned.
+    filters_base_fft: The real FFT of stacked 2D filters in the shape of
+      [channels, height, width // 2 + 1]. This will be learned.
     bias_extended: 2D bias in the shape of [extended_vector_length, height,
       width], a TF tensor. This will be learned.
     bias_base: 2D bias in the shape of [height, width], a TF tensor. This will
@@ -89,22 +89,23 @@ def evaluate_model(rgb, extended_feature, filters_extended_fft,
     # Visualize the chroma histograms for a few datapoints.
     histograms_norm = tf.sqrt(
         chroma_histograms /
-        (1e-7 + tf.reduce_max(chroma_histograms, axis=[1, 2], keepdims=True)))
+        (1e-7 + tf.reduce_max(chroma_histograms, axis=[2, 3], keepdims=True)))
     histograms_vis = tf.cast(
-        tf.round(255. * tf.concat(tf.unstack(histograms_norm, axis=3), axis=2)),
+        tf.round(255. * tf.concat(tf.unstack(histograms_norm, axis=1), axis=2)),
         tf.uint8)[:, :, :, tf.newaxis]
     tf.summary.image('chroma_histograms', histograms_vis)
 
     # Visualize the filters and bias for a few datapoints.
-    filters = fft.fftshift(ops.c2r_ifft2(filters_fft), axis=[1, 2])
+    filters = fft.fftshift(
+        ops.c2r_irfft2(filters_fft, [params['nbins']] * 2), axis=[2, 3])
     filters_quant = tf.cast(
         tf.round(
             127.5 *
             (filters /
-             (1e-7 + tf.reduce_max(tf.abs(filters), axis=[1, 2], keepdims=True))
+             (1e-7 + tf.reduce_max(tf.abs(filters), axis=[2, 3], keepdims=True))
              + 1.)), tf.uint8)
     filters_vis = tf.concat(
-        tf.unstack(filters_quant, axis=3), axis=2)[:, :, :, tf.newaxis]
+        tf.unstack(filters_quant, axis=1), axis=2)[:, :, :, tf.newaxis]
     tf.summary.image('datapoint_filters', filters_vis)
     bias_min = tf.reduce_min(bias, axis=[1, 2], keepdims=True)
     bias_max = tf.reduce_max(bias, axis=[1, 2], keepdims=True)
@@ -112,7 +113,8 @@ def evaluate_model(rgb, extended_feature, filters_extended_fft,
         tf.round(255 * (bias - bias_min) / (bias_max - bias_min)), tf.uint8)
     tf.summary.image('datapoint_bias', bias_vis[:, :, :, tf.newaxis])
 
-  heatmap = ops.eval_features(chroma_histograms, filters_fft, bias)
+  features_fft = ops.precompute_features_fft(chroma_histograms)
+  heatmap = ops.eval_features_fft(features_fft, filters_fft, bias)
 
   mu_idx, sigma_idx = ops.bivariate_von_mises(ops.softmax2(heatmap))
 
@@ -180,13 +182,14 @@ def latent_to_model(filters_extended_latent, filters_base_latent,
   Returns:
     The tuple of (filters_extended_fft, filters_base_fft, bias_extended,
     bias_base, precond_filters, precond_bias).
-      filters_extended_fft: The FFT of stacked 2D filters in the shape of
-        [extended_vector_length, height, width, channels].
-      filters_base_fft: The FFT of stacked 2D filters in the shape of [height,
-        width, channels].
-      bias_extended_fft: The FFT of 2D bias in the shape of
-        [extended_vector_length, height, width].
-      bias_base_fft: The FFT of 2D bias in the shape of [height, width].
+      filters_extended_fft: The real FFT of stacked 2D filters in the shape of
+        [extended_vector_length, channels, height, width // 2 + 1].
+      filters_base_fft: The real FFT of stacked 2D filters in the shape of
+        [channels, height, width // 2 + 1].
+      bias_extended_fft: The real FFT of 2D bias in the shape of
+        [extended_vector_length, 1, height, width // 2 + 1].
+      bias_base_fft: The real FFT of 2D bias in the shape of [1, height,
+        width // 2 + 1].
       bias_extended: 2D bias in the shape of [extended_vector_length, height,
         width].
       bias_base: 2D bias in the shape of [height, width], a TF tensor.
@@ -201,17 +204,24 @@ def latent_to_model(filters_extended_latent, filters_base_latent,
   precond_bias = tf.cast(
       fft.compute_preconditioner_vec(n, hparams['mult_bias_tv'],
                                      hparams['mult_bias_l2'], tf.float32))
-  filters_extended_fft = fft.vec_to_fft2(precond_filters[tf.newaxis, :, :] *
-                                         filters_extended_latent)
-  filters_base_fft = fft.vec_to_fft2(
+
+  # The Fourier coefficients are kept channels-first, and only the
+  # non-redundant half of each Hermitian-symmetric spectrum is kept, which is
+  # what ops.eval_features_fft() and ops.c2r_irfft2() consume.
+  def vec_to_fft2(v):
+    return tf.transpose(fft.vec_to_fft2(v), [0, 3, 1, 2])[..., :n // 2 + 1]
+
+  filters_extended_fft = vec_to_fft2(precond_filters[tf.newaxis, :, :] *
+                                     filters_extended_latent)
+  filters_base_fft = vec_to_fft2(
       (precond_filters * filters_base_latent)[tf.newaxis, :, :])
 
-  bias_extended_fft = fft.vec_to_fft2(
+  bias_extended_fft = vec_to_fft2(
       (precond_bias[tf.newaxis, :, 0] * bias_extended_latent)[:, :, tf.newaxis])
-  bias_base_fft = fft.vec_to_fft2(
+  bias_base_fft = vec_to_fft2(
       (precond_bias[:, 0] * bias_base_latent)[tf.newaxis, :, tf.newaxis])
-  bias_extended = tf.squeeze(ops.c2r_ifft2(bias_extended_fft))
-  bias_base = tf.squeeze(ops.c2r_ifft2(bias_base_fft))
+  bias_extended = tf.squeeze(ops.c2r_irfft2(bias_extended_fft, [n, n]))
+  bias_base = tf.squeeze(ops.c2r_irfft2(bias_base_fft, [n, n]))
 
   return (filters_extended_fft, filters_base_fft, bias_extended_fft,
           bias_base_fft, bias_extended, bias_base, precond_filters,
@@ -238,8 +248,8 @@ def model_builder(hparams):
     """Visualizes FFT filters.
 
     Args:
-      filters_fft: 2D filters in Fourier coefficients in the shape of
-        [batch_size, n, n, channels].
+      filters_fft: 2D filters in real Fourier coefficients in the shape of
+        [batch_size, channels, n, n // 2 + 1].
       shift: performs fftshift if True.
 
     Returns:
@@ -254,12 +264,13 @@ def model_builder(hparams):
           tf.reduce_max(tf.abs(f_centered)), sys.float_info.epsilon)
 
     filters_fft.shape.assert_has_rank(4)
-    filters = ops.c2r_ifft2(filters_fft)
+    n = filters_fft.shape.as_list()[2]
+    filters = ops.c2r_irfft2(filters_fft, [n, n])
     batch_unpacked = tf.unstack(filters)
     rows = []
     for channels in batch_unpacked:
       rows.append(
-          tf.concat([_gen_vis(f, shift) for f in tf.unstack(channels, axis=-1)],
+          tf.concat([_gen_vis(f, shift) for f in tf.unstack(channels, axis=0)],
                     axis=1))
     return tf.concat(rows, axis=0)[tf.newaxis, :, :, tf.newaxis]
 
@@ -327,10 +338,11 @@ def model_builder(hparams):
     precond_bias = tf.cast(
         fft.compute_preconditioner_vec(n, hparams['mult_bias_tv'],
                                        hparams['mult_bias_l2']), tf.float32)
-    bias_base_latent_init = (fft.fft2_to_vec(
+    bias_base_init_fft = tf.transpose(
         ops.r2c_fft2(
-            tf.convert_to_tensor(bias_base_init)[tf.newaxis, :, :,
-                                                 tf.newaxis]))[0] /
+            tf.convert_to_tensor(bias_base_init)[tf.newaxis, tf.newaxis, :, :]),
+        [0, 2, 3, 1])
+    bias_base_latent_init = (fft.fft2_to_vec(bias_base_init_fft)[0] /
                              precond_bias)[:, 0]
     bias_base_latent = tf.get_variable(
         'bias_base_latent', initializer=bias_base_latent_init)
@@ -18,24 +18,18 @@ import numpy as np
 import tensorflow as tf
 
 
-EPS = tf.constant(1e-9, dtype=tf.float32)
+# These are kept as Python floats rather than tf.constant()s: a tensor created
+# at import time cannot be used by the graphs that graph-mode callers (such as
+# model.py and the tf.Session-based tests) build later, nor be captured by the
+# XLA-compiled functions below when they are called from those graphs.
+EPS = 1e-9
+TWO_PI = 2. * math.pi
 
-
-def edge_kernel():
-  """Construct a set of 3x3 kernels for edge computation.
-  Convolving with these kernels produces the average of the absolute
-    difference between each pixel and its 8-connected neighbors.
-  """
-  filters = np.zeros((3, 3, 3, 8))
-  filters[1, 1, :, :] = 1
-  offsets = [-1, 0, 1]
-  i = 0
-  for filter_index, (dx, dy) in enumerate(itertools.product(offsets, repeat=2)):
-    if dx == 0 and dy == 0:
-      i = 1
-      continue
-    filters[1 + dx, 1 + dy, :, filter_index - i] = -1
-  return tf.constant(filters, dtype=tf.float32)
+# The (dy, dx) offsets of the 8-connected neighbors of a pixel, used by
+# local_absolute_deviation().
+_NEIGHBOR_OFFSETS = tuple(
+  (dy, dx) for dy, dx in itertools.product([-1, 0, 1], repeat=2)
+  if (dy, dx) != (0, 0))
 
 
 def sub2ind(range, x, y):
@@ -43,6 +37,11 @@ def sub2ind(range, x, y):
   return y * range + x
 
 
+def _is_power_of_two(x):
+  """Returns True if the (positive) integer x is a power of two."""
+  return x > 0 and (x & (x - 1)) == 0
+
+
 def r2c(real):
   """Real to complex."""
   return tf.complex(real, tf.zeros_like(real))
@@ -50,41 +49,78 @@ def r2c(real):
 
 def c2r(comp):
   """Complex to real."""
-  return tf.real(comp)
+  return tf.math.real(comp)
 
 
 def r2c_fft2(x):
   """Apply 2D-FFT over a real multi-dimensional tensor.
 
+  The tensor is channels-first, so that the FFT runs over the two innermost
+    dimensions without any transpose.
+
   Args:
-    x: A tensor in real number. The rank of the tensor is == 4.
+    x: A channels-first tensor in real number. The rank of the tensor is == 4.
 
   Returns:
-    A complex tensor where [-1, :, :, i] = fft2(t[-1, :, :, i]).
+    A complex tensor where [-1, i, :, :] = fft2(t[-1, i, :, :]).
   """
   ndims = x.get_shape().ndims
   if ndims != 4:
     raise ValueError('Expecting ndims == 4, actual={}'.format(ndims))
-  x_fft = tf.transpose(
-    tf.signal.fft2d(tf.transpose(r2c(x), [0, 3, 1, 2])), [0, 2, 3, 1])
-  return x_fft
+  return tf.signal.fft2d(r2c(x))
 
 
 def c2r_ifft2(x_fft):
-  """Apply 2D-iFFT over a 3D complex tensor and saves only real numbers.
+  """Apply 2D-iFFT over a 4D complex tensor and saves only real numbers.
+
+  Args:
+    x_fft: A channels-first tensor in complex number, as produced by
+      r2c_fft2(). The rank of the tensor is == 4.
+
+  Returns:
+    A real tensor where [-1, i, :, :] = real(ifft2(t[-1, i, :, :])).
+  """
+  ndims = x_fft.get_shape().ndims
+  if ndims != 4:
+    raise ValueError('Expecting ndims == 4, actual={}'.format(ndims))
+  return c2r(tf.signal.ifft2d(x_fft))
+
+
+def r2c_rfft2(x):
+  """Apply 2D real-FFT over a real multi-dimensional tensor.
+
+  Only the non-redundant half of the Hermitian-symmetric spectrum is kept, which
+    halves the size of the output compared to r2c_fft2().
+
+  Args:
+    x: A channels-first tensor in real number. The rank of the tensor is == 4.
+
+  Returns:
+    A complex tensor in the shape of [batch_size, channels, height,
+      width // 2 + 1], where [-1, i, :, :] = rfft2(t[-1, i, :, :]).
+  """
+  ndims = x.get_shape().ndims
+  if ndims != 4:
+    raise ValueError('Expecting ndims == 4, actual={}'.format(ndims))
+  return tf.signal.rfft2d(x)
+
+
+def c2r_irfft2(x_fft, fft_length):
+  """Inverse of r2c_rfft2().
 
   Args:
-    x_fft: A tensor in complex number. The rank of the tensor is == 4.
+    x_fft: A channels-first tensor in complex number, as produced by
+      r2c_rfft2(). The rank of the tensor is == 4.
+    fft_length: the [height, width] of the real output. This has to be given
+      since both an even and an odd width produce the same x_fft width.
 
   Returns:
-    A real tensor where [-1, :, :, i] = real(ifft2(t[-1, :, :, i])).
+    A real tensor where [-1, i, :, :] = irfft2(t[-1, i, :, :]).
   """
   ndims = x_fft.get_shape().ndims
   if ndims != 4:
     raise ValueError('Expecting ndims == 4, actual={}'.format(ndims))
-  return c2r(
-    tf.transpose(
-      tf.signal.ifft2d(tf.transpose(x_fft, [0, 3, 1, 2])), [0, 2, 3, 1]))
+  return tf.signal.irfft2d(x_fft, fft_length=fft_length)
 
 
 def local_absolute_deviation(rgb):
@@ -102,59 +138,109 @@ def local_absolute_deviation(rgb):
       in the rgb input image.
   """
 
-  # Padding the image before computing the image's edges to avoid introducing
-  # new edges in image's borders.
-  # pad +1 in width and height, but not in channels nor batch_size
-  paddings = tf.constant([[0, 0], [1, 1], [1, 1], [0, 0]],
-                         dtype='int32')
-  rgb_padded = tf.pad(rgb, paddings, mode='SYMMETRIC')
-
-  # Applying a series of conv filters to compute the absolute deviation in
-  # the input image
-  edge_filters = edge_kernel()
-  filtered = tf.nn.depthwise_conv2d(rgb_padded, edge_filters,
-                                    strides=[1, 1, 1, 1], padding='VALID')
-  filtered = tf.reshape(filtered, (filtered.shape[0], filtered.shape[1],
-                                   filtered.shape[2], 3, 8))
-  abs_diff = tf.abs(filtered)
-  rgb_edge = tf.math.reduce_mean(abs_diff, axis=-1)
+  # The neighbors of the border pixels are taken from a symmetric padding of
+  # the image by 1 pixel, to avoid introducing new edges in image's borders.
+  # With a padding of 1, mirroring a neighbor index back into the image is the
+  # same as clamping it, so the neighbors are gathered with clamped indices
+  # rather than padding (and copying) the whole image first.
+  def shifted_indices(size, offset):
+    return tf.clip_by_value(tf.range(size) + offset, 0, size - 1)
+
+  height = tf.shape(rgb)[1]
+  width = tf.shape(rgb)[2]
+  rgb_rows = {
+    dy: tf.gather(rgb, shifted_indices(height, dy), axis=1) if dy else rgb
+    for dy in (-1, 0, 1)
+  }
+
+  # Accumulate the absolute difference between each pixel and its 8-connected
+  # neighbors directly, rather than convolving with 8 filters and reducing over
+  # a [batch_size, height, width, 3, 8] intermediate. Eagerly this is still 8
+  # separate gather/abs/add ops, which fuse into a single pass under XLA (as in
+  # data_preprocess()).
+  abs_deviation = tf.zeros_like(rgb)
+  for dy, dx in _NEIGHBOR_OFFSETS:
+    neighbor = rgb_rows[dy]
+    if dx:
+      neighbor = tf.gather(neighbor, shifted_indices(width, dx), axis=2)
+    abs_deviation += tf.abs(rgb - neighbor)
+  rgb_edge = abs_deviation / len(_NEIGHBOR_OFFSETS)
   return rgb_edge
 
+
 def compute_chroma_histogram(rgb, params):
   """This function produces a 2D histogram of the log-chroma of a given image.
 
+  Several image streams (e.g. an image and its edge image) can be histogrammed
+    in a single pass by stacking them along the second axis.
+
   Args:
-    rgb: RGB image (float32) with the shape of [batch_size, height, width, 3].
+    rgb: RGB image (float32) with the shape of [batch_size, height, width, 3],
+      or a stack of RGB images with the shape of [batch_size, num_streams,
+      height, width, 3].
     params: a dict with keys:
     'first_bin': (float) location of the edge of the first histogram bin.
     'bin_size': (float) size of each histogram bin.
     'nbins': (int) number of histogram bins.
 
   Returns:
-    histogram: a 2D histogram (float32) of the log-chroma of a given image
-      with the shape of [batch_size, height, width, channels]
+    histogram: a channels-first 2D histogram (float32) of the log-chroma of a
+      given image with the shape of [batch_size, num_streams, nbins, nbins],
+      where num_streams is 1 for a 4D input.
   """
 
-  batch_size = rgb.shape[0]
+  rgb = tf.convert_to_tensor(rgb)
+  if rgb.shape.ndims == 4:
+    rgb = rgb[:, tf.newaxis]
+  num_streams = rgb.shape[1]
+
+  # Fold the streams into the batch so that each op below runs once over all
+  # of the streams.
+  rgb = tf.reshape(rgb, tf.concat([[-1], tf.shape(rgb)[2:]], axis=0))
+  batch_size = tf.shape(rgb)[0]
   valid_pixels = tf.math.reduce_min(rgb, axis=3) > EPS
   first_bin = tf.convert_to_tensor(params['first_bin'], dtype=tf.float32)
   bin_size = tf.convert_to_tensor(params['bin_size'], dtype=tf.float32)
   nbins = tf.convert_to_tensor(params['nbins'], dtype=tf.int32)
 
-  # Exclude any zero pixels (at any color channel)
-  valid_colors = tf.reshape(tf.gather_nd(rgb, tf.where(valid_pixels)),
-                            (batch_size, -1, 3))
-  uv = rgb_to_uv(valid_colors)
+  # Exclude any zero pixels (at any color channel) by counting them into an
+  # extra bin that is dropped afterwards, rather than gathering the valid pixels
+  # into a dynamically-shaped tensor. Zero pixels are replaced by ones to keep
+  # their log-chroma finite. Negative pixels are invalid as well, so safe_rgb
+  # always passes rgb_to_uv()'s non-negativity check (which XLA would drop when
+  # this runs inside data_preprocess()).
+  safe_rgb = tf.where(valid_pixels[..., tf.newaxis], rgb, tf.ones_like(rgb))
+  uv = rgb_to_uv(safe_rgb)
   uv_bin_index = tf.cast(tf.math.floormod(
     tf.round((uv - first_bin) / bin_size),
     tf.cast(nbins, tf.float32)), tf.int32)
-  indices = sub2ind(nbins, uv_bin_index[:, :, 1],
-                    uv_bin_index[:, :, 0])
-  histogram = tf.cast(tf.reshape(tf.math.bincount(
-    indices, minlength=nbins * nbins, axis=-1),
-    [batch_size, nbins, nbins, 1]), dtype=tf.float32)
-  histogram = histogram / tf.math.maximum(EPS, tf.reduce_sum(
-    histogram, axis=[1, 2, 3]))
+  if isinstance(params['nbins'], int) and _is_power_of_two(params['nbins']):
+    # With a power-of-two number of bins, sub2ind's multiply-add reduces to a
+    # shift and an or, since the v index is always < nbins.
+    log2_nbins = params['nbins'].bit_length() - 1
+    indices = tf.bitwise.bitwise_or(
+      tf.bitwise.left_shift(uv_bin_index[..., 0], log2_nbins),
+      uv_bin_index[..., 1])
+  else:
+    indices = sub2ind(nbins, uv_bin_index[..., 1], uv_bin_index[..., 0])
+
+  # Offset the indices of each image by its own nbins * nbins block, so that
+  # a single bincount produces the histograms of all the images.
+  image_index = tf.range(batch_size)[:, tf.newaxis, tf.newaxis]
+  indices += image_index * nbins * nbins
+  num_bins = batch_size * nbins * nbins
+  indices = tf.where(valid_pixels, indices, num_bins)
+  # An unweighted bincount produces int32 counts, which is cheaper than
+  # accumulating float weights.
+  counts = tf.math.bincount(
+    tf.reshape(indices, [-1]), minlength=num_bins + 1,
+    maxlength=num_bins + 1)[:num_bins]
+  counts = tf.reshape(counts, [-1, num_streams, nbins, nbins])
+  num_valid_pixels = tf.reshape(
+    tf.reduce_sum(tf.cast(valid_pixels, tf.int32), axis=[1, 2]),
+    [-1, num_streams, 1, 1])
+  histogram = tf.cast(counts, tf.float32) / tf.math.maximum(
+    EPS, tf.cast(num_valid_pixels, tf.float32))
 
   return histogram
 
@@ -175,20 +261,20 @@ def featurize_image(rgb, params):
 
   Returns:
     chroma_histograms: stack of 2D 2-channel chroma histograms (float32) from
-      the filter bank. For each channel, the chroma histogram is generated
-      from the input as described below:
+      the filter bank, with the shape of [batch_size, 2, nbins, nbins]. For
+      each channel, the chroma histogram is generated from the input as
+      described below:
       ch = 0: from RGB input.
       ch = 1: from edge filter input.
   """
 
-  histogram = compute_chroma_histogram(rgb, params)
-  edge_rgb = local_absolute_deviation(rgb)
-  histogram_edges = compute_chroma_histogram(edge_rgb, params)
-  chroma_histograms = tf.concat((histogram, histogram_edges), axis=3)
+  rgb_stack = tf.stack([rgb, local_absolute_deviation(rgb)], axis=1)
+  chroma_histograms = compute_chroma_histogram(rgb_stack, params)
 
   return chroma_histograms
 
 
+@tf.function(jit_compile=True)
 def data_preprocess(rgb, extended_feature, params):
   """Convert inputs to histogram features for TensorFlow.
 
@@ -206,8 +292,9 @@ def data_preprocess(rgb, extended_feature, params):
 
   Returns:
     chroma_histograms: stack of 2D chroma histograms (float32) from the
-      filter bank: For each channel, the chroma histogram is generated from the
-      input as described below:
+      filter bank, with the shape of [batch_size, 2, nbins, nbins]: For each
+      channel, the chroma histogram is generated from the input as described
+      below:
         ch = 0: from RGB input.
         ch = 1: from edge filter input.
     extended_features: A 1D vector (float32) with encoded extended feature
@@ -221,55 +308,98 @@ def data_preprocess(rgb, extended_feature, params):
   return chroma_histograms, extended_features
 
 
+def precompute_features_fft(features):
+  """Computes the real 2D-FFT of the features consumed by eval_features_fft().
+
+  The features of a batch do not depend on the model, so their FFT can be
+  computed once and then shared by every evaluation of that batch.
+
+  Args:
+    features: input multi-channel feature with shape of [batch_size, channels,
+      height, width]
+
+  Returns:
+    The real fft of the features with shape of [batch_size, channels, height,
+    width // 2 + 1].
+  """
+  return r2c_rfft2(features)
+
+
+@tf.function(jit_compile=True)
+def eval_features_fft(features_fft, filters_fft, bias):
+  """Same as eval_features(), but on the real fft of the features.
+
+  Args:
+    features_fft: The real fft of input multi-channel feature with shape of
+      [batch_size, channels, height, width // 2 + 1], as produced by
+      precompute_features_fft().
+    filters_fft: The real fft of input convolution kernels with shape of
+      [batch_size, channels, height, width // 2 + 1], as produced by
+      r2c_rfft2().
+    bias: input bias with shape of [batch_size, height, width]
+
+  Returns:
+    A convolved result with shape of [batch_size, H, W]
+  """
+  # Checking shapes. The checks are done on the static shapes while building
+  # the graph, so that they do not add assertion ops to every evaluation. The
+  # width of the features is lost in their real fft, so it is taken from the
+  # bias.
+  features_fft = tf.convert_to_tensor(features_fft)
+  filters_fft = tf.convert_to_tensor(filters_fft)
+  bias = tf.cast(bias, dtype=features_fft.dtype.real_dtype)
+  features_fft.shape.assert_has_rank(4)
+  bias.shape.assert_has_rank(3)
+  batch_size, num_channels, height, rfft_width = features_fft.shape
+  width = bias.shape[2]
+  if width is not None:
+    features_fft.shape.assert_is_compatible_with(
+      [batch_size, num_channels, height, width // 2 + 1])
+  filters_fft.shape.assert_is_compatible_with(
+    [batch_size, num_channels, height, rfft_width])
+  bias.shape.assert_is_compatible_with([batch_size, height, width])
+
+  # Multiply and sum over the channels in the Fourier domain as a single
+  # contraction, which leaves a [batch, n, n // 2 + 1] tensor whose inner two
+  # dimensions can be inverted without a transpose.
+  fx_fft = tf.einsum('bchw,bchw->bhw', features_fft, filters_fft)
+  fx = tf.signal.irfft2d(fx_fft, fft_length=tf.shape(bias)[1:])
+
+  h = tf.add(fx, bias, name='H')
+  return h
+
+
+@tf.function(jit_compile=True)
 def eval_features(features, filters_fft, bias):
   """Convolve the features with a 2D-FFT and sum the result across channels.
 
   This is also known as a convolution layer, where the innermost dimension is
     "batch size", and the outermost dimension is the channels (same behavior
     as tf.conv2d). The operation would return a filtered histogram:
-    H = sum(conv2d(features, ifft(filters_fft), boundary='wrap'), axis=3) + bias
+    H = sum(conv2d(features, irfft(filters_fft), boundary='wrap'), axis=1) + bias
+
+  When the same features are evaluated against several filters, use
+  precompute_features_fft() and eval_features_fft() instead, so that the FFT
+  of the features is only computed once.
 
   Args:
-    features: input multi-channel feature with shape of [batch_size, hight,
-      width, channels]
-    filters_fft: The fft of input convolution kernels with shape of [batch_size,
-      height, width, channels]
+    features: input multi-channel feature with shape of [batch_size, channels,
+      hight, width]
+    filters_fft: The real fft of input convolution kernels with shape of
+      [batch_size, channels, height, width // 2 + 1], as produced by
+      r2c_rfft2().
     bias: input bias with shape of [batch_size, height, width]
 
   Returns:
     A convolved result with shape of [batch_size, H, W]
   """
-  # Checking shapes
-  feature_shape = tf.shape(features)
-  batch_size = feature_shape[0]
-  height = feature_shape[1]
-  width = feature_shape[2]
-  num_channels = feature_shape[3]
-
-  deps = [
-    tf.assert_equal(batch_size,
-                    tf.shape(filters_fft)[0]),
-    tf.assert_equal(height,
-                    tf.shape(filters_fft)[1]),
-    tf.assert_equal(width,
-                    tf.shape(filters_fft)[2]),
-    tf.assert_equal(num_channels,
-                    tf.shape(filters_fft)[3]),
-    tf.assert_equal(batch_size,
-                    tf.shape(bias)[0]),
-    tf.assert_equal(height,
-                    tf.shape(bias)[1]),
-    tf.assert_equal(width,
-                    tf.shape(bias)[2]),
-  ]
-  with tf.control_dependencies(deps):
-    fx_fft = tf.reduce_sum(
-      r2c_fft2(features) * filters_fft, axis=3, keepdims=True)
-    fx = c2r_ifft2(fx_fft)
-
-    # Squeeze the last dimension from [batch, n, n, 1] to [batch, n , n]
-    h = tf.add(tf.squeeze(fx, axis=[3]), bias, name='H')
-    return h
+  features = tf.convert_to_tensor(features)
+  features.shape.assert_has_rank(4)
+  bias = tf.cast(bias, dtype=features.dtype)
+  bias.shape.assert_is_compatible_with(
+    [features.shape[0], features.shape[2], features.shape[3]])
+  return eval_features_fft(
+    precompute_features_fft(features), filters_fft, bias)
 
 
 def softmax2(h):
@@ -281,13 +411,45 @@ def softmax2(h):
   Returns:
     output PMF (Probability Mass Function) with shape [batch_size, H, W].
   """
-  # Find the max value from h.
   ndims = h.get_shape().ndims
   if ndims != 3:
     raise ValueError('Expecting ndims = 3, actual={}'.format(ndims))
-  _, height, width = h.get_shape().as_list()
-  return tf.reshape(
-    tf.nn.softmax(tf.reshape(h, [-1, width * height])), [-1, height, width])
+  # A numerically-stable softmax over the two inner dimensions: subtract the
+  # max value of each h before exponentiating.
+  h_max = tf.reduce_max(h, axis=[1, 2], keepdims=True)
+  exp_h = tf.exp(h - h_max)
+  return exp_h / tf.reduce_sum(exp_h, axis=[1, 2], keepdims=True)
+
+
+# The constants of bivariate_von_mises(), which only depend on the size of the
+# PMF, keyed by that size. These are kept as numpy arrays, so that they can be
+# embedded into any graph that uses them.
+_VON_MISES_CONSTANTS = {}
+
+
+def _von_mises_constants(size):
+  """Returns the constants of bivariate_von_mises() for a PMF size.
+
+  Args:
+    size: the size of the (square) PMF, a Python int.
+
+  Returns:
+    Tuple of:
+      angle_basis: the cosine and the sine of the angle of each bin, in the
+        shape of [size, 2].
+      shifted_bins: the index of each bin shifted by half of the size, in the
+        shape of [size]. The shift centers the wrapped distances between the
+        bins and the mean.
+      angle_step: the angle between two neighboring bins, scalar.
+  """
+  if size not in _VON_MISES_CONSTANTS:
+    angle_step = 2. * math.pi / size
+    angles = np.arange(size) * angle_step
+    _VON_MISES_CONSTANTS[size] = (
+      np.stack([np.cos(angles), np.sin(angles)], axis=1).astype(np.float32),
+      np.arange(size, dtype=np.float32) + size / 2.,
+      angle_step)
+  return _VON_MISES_CONSTANTS[size]
 
 
 def bivariate_von_mises(pmf):
@@ -310,6 +472,7 @@ def bivariate_von_mises(pmf):
         shape of [batch_size, 2, 2].
   """
   # The PMF is in the shape of [-1, V, U]
+  pmf = tf.convert_to_tensor(pmf)
   pmf_shape = pmf.get_shape().as_list()
   ndims = pmf.get_shape().ndims
   sums = tf.reduce_sum(pmf, axis=list(range(1, ndims)), keepdims=True)
@@ -322,68 +485,74 @@ def bivariate_von_mises(pmf):
     tf.debugging.assert_near(sums, 1, atol=1e-4)
   ]
 
+  # XLA drops assertions, so the PMF is checked here rather than inside the
+  # compiled fit.
   with tf.control_dependencies(deps):
-    sum_u = tf.reduce_sum(pmf, axis=2)
-    sum_v = tf.reduce_sum(pmf, axis=1)
+    return _fit_bivariate_von_mises(pmf)
 
-    size = pmf_shape[1]
-    angle_step = 2. * math.pi / size
-    angles = tf.reshape(
-      tf.range(size, dtype=tf.float32) * angle_step, [1, size])
-
-    cos_angles = tf.cos(angles)
-    sin_angles = tf.sin(angles)
-
-    # Compute the expected value of sine and cosine to handle wrap-around
-    # boundary
-    expected_cos_v = tf.reduce_sum(sum_v * cos_angles, axis=1, keepdims=True)
-    expected_sin_v = tf.reduce_sum(sum_v * sin_angles, axis=1, keepdims=True)
-    expected_cos_u = tf.reduce_sum(sum_u * cos_angles, axis=1, keepdims=True)
-    expected_sin_u = tf.reduce_sum(sum_u * sin_angles, axis=1, keepdims=True)
-
-    # With the expected cosine and sine of the angle, we can compute the angular
-    # center of mass by computing the arctangent.
-    # Note: atan2 returns the range of [-PI .. PI], and we want to shift it to
-    # [0 .. 2*PI] and snap into histogram grids
-    # NOTE:
-    #   There is a TF bug that causing tf.mod returns incorrect result when the
-    #   concatenated input is given:
-    #     theta = tf.atan2(expected_sin_u, expected_cos_u)
-    #     phi = tf.atan2(expected_sin_v, expected_cos_v)
-    #     mean_angle = tf.mod(tf.concat([theta, phi], axis=1), 2.0 * math.pi)
-    #   phi will return incorrect value:
-    #     2.71980858 % (2.0 * PI) becomes 2.76635933.
-    # The following attempt is to avoid the TF bug.
-    two_pi = 2.0 * math.pi
-    theta = tf.math.mod(tf.atan2(expected_sin_u, expected_cos_u), two_pi)
-    phi = tf.math.mod(tf.atan2(expected_sin_v, expected_cos_v), two_pi)
-    mean_angle = tf.concat([theta, phi], axis=1)
-
-    # Convert the angle back to histogram grid indices
-    mu = tf.divide(mean_angle, angle_step, name='mu_idx')
-
-    # Compute the covariance matrix.
-    bins = tf.range(pmf_shape[1], dtype=tf.float32)
-    u_delta = bins - mu[:, tf.newaxis, 0]
-    v_delta = bins - mu[:, tf.newaxis, 1]
-    wrap = lambda x: tf.math.mod(x + pmf_shape[1] / 2, pmf_shape[1])
-    u_wrapped = wrap(u_delta)
-    v_wrapped = wrap(v_delta)
-    sum1 = lambda x: tf.reduce_sum(x, axis=-1)
-    u_expectation = sum1(sum_u * u_wrapped)
-    v_expectation = sum1(sum_v * v_wrapped)
-    u_var = sum1(sum_u * u_wrapped**2) - u_expectation**2
-    v_var = sum1(sum_v * v_wrapped**2) - v_expectation**2
-    uv_expectation = tf.linalg.matvec(
-      tf.linalg.matvec(pmf, u_wrapped, transpose_a=True)[..., tf.newaxis, :],
-      v_wrapped)[..., 0]
-    uv_covar = uv_expectation - u_expectation * v_expectation
-
-    # Construct covariance matrices.
-    sigma = tf.reshape(
-      tf.stack([u_var, uv_covar, uv_covar, v_var], axis=1), [-1, 2, 2],
-      name='sigma_idx')
-    return mu, sigma
+
+@tf.function(jit_compile=True)
+def _fit_bivariate_von_mises(pmf):
+  """Fits a bivariate von Mises over a PMF.
+
+  This is the XLA-compiled part of bivariate_von_mises(), which has already
+    checked that pmf is a batch of square PMFs that each sum to 1.
+  """
+  pmf_shape = pmf.get_shape().as_list()
+  sum_u = tf.reduce_sum(pmf, axis=2)
+  sum_v = tf.reduce_sum(pmf, axis=1)
+
+  angle_basis, shifted_bins, angle_step = _von_mises_constants(pmf_shape[1])
+
+  # Compute the expected value of sine and cosine to handle wrap-around
+  # boundary. All four expectations are computed with a single matmul:
+  # [batch, (u, v), size] x [size, (cos, sin)] -> [batch, (u, v), (cos, sin)]
+  expected = tf.matmul(tf.stack([sum_u, sum_v], axis=1), angle_basis)
+  expected_cos_u = expected[:, 0, 0:1]
+  expected_sin_u = expected[:, 0, 1:2]
+  expected_cos_v = expected[:, 1, 0:1]
+  expected_sin_v = expected[:, 1, 1:2]
+
+  # With the expected cosine and sine of the angle, we can compute the angular
+  # center of mass by computing the arctangent.
+  # Note: atan2 returns the range of [-PI .. PI], and we want to shift it to
+  # [0 .. 2*PI] and snap into histogram grids
+  # NOTE:
+  #   There is a TF bug that causing tf.mod returns incorrect result when the
+  #   concatenated input is given:
+  #     theta = tf.atan2(expected_sin_u, expected_cos_u)
+  #     phi = tf.atan2(expected_sin_v, expected_cos_v)
+  #     mean_angle = tf.mod(tf.concat([theta, phi], axis=1), 2.0 * math.pi)
+  #   phi will return incorrect value:
+  #     2.71980858 % (2.0 * PI) becomes 2.76635933.
+  # The following attempt is to avoid the TF bug.
+  theta = tf.math.mod(tf.atan2(expected_sin_u, expected_cos_u), TWO_PI)
+  phi = tf.math.mod(tf.atan2(expected_sin_v, expected_cos_v), TWO_PI)
+  mean_angle = tf.concat([theta, phi], axis=1)
+
+  # Convert the angle back to histogram grid indices
+  mu = tf.divide(mean_angle, angle_step, name='mu_idx')
+
+  # Compute the covariance matrix.
+  # The distances to the mean are wrapped into [0, size), centered at
+  # size / 2, which is already folded into shifted_bins.
+  u_wrapped = tf.math.mod(shifted_bins - mu[:, tf.newaxis, 0], pmf_shape[1])
+  v_wrapped = tf.math.mod(shifted_bins - mu[:, tf.newaxis, 1], pmf_shape[1])
+  sum1 = lambda x: tf.reduce_sum(x, axis=-1)
+  u_expectation = sum1(sum_u * u_wrapped)
+  v_expectation = sum1(sum_v * v_wrapped)
+  u_var = sum1(sum_u * u_wrapped**2) - u_expectation**2
+  v_var = sum1(sum_v * v_wrapped**2) - v_expectation**2
+  uv_expectation = tf.linalg.matvec(
+    tf.linalg.matvec(pmf, u_wrapped, transpose_a=True)[..., tf.newaxis, :],
+    v_wrapped)[..., 0]
+  uv_covar = uv_expectation - u_expectation * v_expectation
+
+  # Construct covariance matrices.
+  sigma = tf.reshape(
+    tf.stack([u_var, uv_covar, uv_covar, v_var], axis=1), [-1, 2, 2],
+    name='sigma_idx')
+  return mu, sigma
 
 
 def idx_to_uv(mu_idx, sigma_idx, step_size, offset):
@@ -434,38 +603,39 @@ def splat_non_uniform(x, bins):
       where each row is the splat weights.
   """
 
-  bin_num = tf.size(bins)
-  bins = tf.expand_dims(bins, axis=0)
-  batch_size = x.shape[0]
+  # The splat weights are float32, like the one-hot rows they scale.
+  x = tf.cast(x, dtype=tf.float32)
+  bins = tf.cast(bins, dtype=tf.float32)
+  # Prefer the static number of bins, so that the one-hot depth is static.
+  bin_num = bins.shape[0]
+  if bin_num is None:
+    bin_num = tf.size(bins)
 
   # clamps the x into the boundary of bins
-  x_clamp = tf.clip_by_value(x, tf.math.reduce_min(bins), tf.math.reduce_max(
-    bins))
-
-  nearest_bin = tf.math.argmin(tf.abs(
-    tf.transpose(bins - x_clamp)), output_type=tf.int32)
-
-  idx_lo = tf.expand_dims(tf.minimum(nearest_bin, bin_num -
-                                     tf.minimum(2, bin_num)), axis=1)
-  idx_hi = tf.minimum(idx_lo + 1, bin_num - 1)
-
-  low_bin_value = tf.gather_nd(bins[0, :], idx_lo)
-  high_bin_value = tf.gather_nd(bins[0, :], idx_hi)
-
-  w_high = tf.reshape((tf.squeeze(x_clamp) - low_bin_value) /
-                      (tf.maximum(high_bin_value - low_bin_value, EPS)), -1)
+  x_clamp = tf.reshape(
+    tf.clip_by_value(x, tf.math.reduce_min(bins), tf.math.reduce_max(bins)),
+    [-1])
+
+  # Binary search for the pair of bins that brackets each x, i.e.
+  # bins[idx_lo] <= x <= bins[idx_hi]. With a single bin, both are 0.
+  insert_idx = tf.searchsorted(bins, x_clamp)
+  insert_idx = tf.clip_by_value(insert_idx, 1, tf.maximum(bin_num - 1, 1))
+  idx_lo = insert_idx - 1
+  idx_hi = tf.minimum(insert_idx, bin_num - 1)
+
+  low_bin_value = tf.gather(bins, idx_lo)
+  high_bin_value = tf.gather(bins, idx_hi)
+
+  w_high = (x_clamp - low_bin_value) / (
+    tf.maximum(high_bin_value - low_bin_value, EPS))
   w_low = 1.0 - w_high
-  indices = tf.tile(tf.expand_dims(tf.range(0, bin_num), axis=0),
-                    [batch_size, 1])
-  extended_features_h = tf.sparse.SparseTensor(
-    indices=tf.where(indices == idx_hi), values=w_high,
-    dense_shape=[batch_size, bin_num])
-  extended_features_l = tf.sparse.SparseTensor(
-    indices=tf.where(indices == idx_lo), values=w_low,
-    dense_shape=[batch_size, bin_num])
 
-  return (tf.sparse.to_dense(extended_features_l) + tf.sparse.to_dense(
-    extended_features_h))
+  # Splat the weights into their bins with one-hot rows, which keeps the
+  # output dense and static-shaped.
+  return (tf.one_hot(idx_lo, bin_num, dtype=tf.float32) *
+          w_low[:, tf.newaxis] +
+          tf.one_hot(idx_hi, bin_num, dtype=tf.float32) *
+          w_high[:, tf.newaxis])
 
 
 def uv_to_pmf(uv, step_size, offset, n):
@@ -491,16 +661,18 @@ def uv_to_pmf(uv, step_size, offset, n):
   uv_max = offset + (n - 1) * step_size
 
   def uv_fmin():
-    return tf.print(uv, [
+    with tf.control_dependencies([tf.print(uv, [
       'WARNING: uv_to_pmf() given values of ',
       tf.reduce_min(uv), ' < ', uv_min, ', clipping.'
-    ])
+    ])]):
+      return tf.identity(uv)
 
   def uv_fmax():
-    return tf.print(uv, [
+    with tf.control_dependencies([tf.print(uv, [
       'WARNING: uv_to_pmf() given values of ',
       tf.reduce_max(uv), ' > ', uv_max, ', clipping.'
-    ])
+    ])]):
+      return tf.identity(uv)
 
   uv = tf.cond(tf.reduce_any(uv < uv_min), uv_fmin, lambda: uv)
   uv = tf.cond(tf.reduce_any(uv > uv_max), uv_fmax, lambda: uv)
@@ -515,13 +687,23 @@ def uv_to_pmf(uv, step_size, offset, n):
     raise ValueError('`step_size` must be a scalar, but is of type {}'.format(
       type(offset)))
 
+  return _splat_uv(uv, step_size, offset, n)
+
+
+@tf.function(jit_compile=True)
+def _splat_uv(uv, step_size, offset, n):
+  """Bilinearly splats in-range log-UV coordinates into PMFs.
+
+  This is the XLA-compiled part of uv_to_pmf(), which has already clipped uv
+    into the range of the PMF. Printing the out-of-range warnings cannot be
+    compiled, so it is kept out of this function.
+  """
   uv_idx = (uv - offset) / step_size
 
   uv_idx_lo = tf.floor(uv_idx)
-  # Protects from the boundary error by wrapping around. Clamping would cause
-  # assertion on tf.SparseTensor due to repeated indices. However, we also
-  # checks the range of uv_idx to be within [0 .. n-1], so the clamping would
-  # not affect the numerical correctness.
+  # Protects from the boundary error by wrapping around. We also checks the
+  # range of uv_idx to be within [0 .. n-1], so the wrapping would not affect
+  # the numerical correctness.
   uv_idx_hi = tf.math.mod(uv_idx_lo + 1, n)
 
   w_1 = uv_idx - uv_idx_lo
@@ -540,11 +722,12 @@ def uv_to_pmf(uv, step_size, offset, n):
   idx_10 = tf.stack([batch_idx, uv_idx_hi[:, 0], uv_idx_lo[:, 1]], axis=1)
   idx_11 = tf.stack([batch_idx, uv_idx_hi[:, 0], uv_idx_hi[:, 1]], axis=1)
 
-  sparse = tf.SparseTensor(
+  # Scatter the bilinear weights directly into a dense PMF. Repeated indices
+  # are summed, so no sorting of the indices is required.
+  return tf.scatter_nd(
     indices=tf.concat([idx_00, idx_01, idx_10, idx_11], axis=0),
-    values=tf.concat([w_00, w_01, w_10, w_11], axis=0),
-    dense_shape=[batch_size, n, n])
-  return tf.sparse.to_dense(tf.sparse.reorder(sparse))
+    updates=tf.concat([w_00, w_01, w_10, w_11], axis=0),
+    shape=tf.cast([batch_size, n, n], dtype=tf.int64))
 
 
 def rgb_to_uv(rgb):
@@ -563,16 +746,17 @@ def rgb_to_uv(rgb):
 
   rgb = tf.convert_to_tensor(rgb)
   tf.debugging.assert_equal(rgb.shape[-1], 3)
-  rgb_reshaped = tf.reshape(rgb, (-1, 3))
   deps = [tf.debugging.assert_greater_equal(
-    rgb_reshaped, tf.cast(0.0, dtype=rgb_reshaped.dtype))]
+    rgb, tf.cast(0.0, dtype=rgb.dtype))]
   # Protects the value from division by 0
-  rgb_reshaped = tf.maximum(rgb_reshaped, EPS)
+  rgb = tf.maximum(rgb, EPS)
   with tf.control_dependencies(deps):
-    log_rgb = tf.math.log(rgb_reshaped)
-    u = tf.reshape(log_rgb[:, 1] - log_rgb[:, 0], rgb.shape[:-1])
-    v = tf.reshape(log_rgb[:, 1] - log_rgb[:, 2], rgb.shape[:-1])
-    return tf.stack([u, v], axis=tf.rank(rgb) - 1)
+    # Work on the last axis directly, so that the output keeps the input's
+    # shape without reshaping to [-1, 3] and back.
+    log_rgb = tf.math.log(rgb)
+    u = log_rgb[..., 1] - log_rgb[..., 0]
+    v = log_rgb[..., 1] - log_rgb[..., 2]
+    return tf.stack([u, v], axis=-1)
 
 
 def uv_to_rgb(uv):
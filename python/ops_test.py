@@ -41,6 +41,74 @@ class OpsTest(tf.test.TestCase):
             ops.c2r_ifft2(ops.r2c_fft2(tf.constant(t, dtype=tf.float32)))))
     np.testing.assert_allclose(t, t_reconstructed, atol=1e-06)
 
+  def testRfft2RoundTrip(self):
+    # I == irfft2(rfft2(I)), for both an even and an odd width.
+    batch_size = 2
+    for width in [6, 7]:
+      t = np.random.uniform(size=(batch_size, 2, 3, width))
+      t_reconstructed = np.asarray(
+          self._eval(
+              ops.c2r_irfft2(
+                  ops.r2c_rfft2(tf.constant(t, dtype=tf.float32)),
+                  [3, width])))
+      np.testing.assert_allclose(t, t_reconstructed, atol=1e-06)
+
+  def testLocalAbsoluteDeviation(self):
+    """Compares against the mean absolute difference to the 8 neighbors."""
+    batch_size = 2
+    height = 5
+    width = 7
+    rgb = np.random.uniform(size=(batch_size, height, width, 3))
+    rgb_padded = np.pad(rgb, [(0, 0), (1, 1), (1, 1), (0, 0)], mode='symmetric')
+    expected = np.zeros_like(rgb)
+    for dy in [-1, 0, 1]:
+      for dx in [-1, 0, 1]:
+        neighbor = rgb_padded[:, 1 + dy:1 + dy + height,
+                              1 + dx:1 + dx + width, :]
+        expected += np.abs(rgb - neighbor) / 8.
+
+    rgb_edge = self._eval(
+        ops.local_absolute_deviation(tf.constant(rgb, dtype=tf.float32)))
+    np.testing.assert_allclose(rgb_edge, expected, atol=1e-6)
+
+  def testComputeChromaHistogramStreams(self):
+    """Stacked streams should match histogramming each stream separately."""
+    params = {'first_bin': -0.5, 'bin_size': 1. / 32., 'nbins': 64}
+    batch_size = 3
+    rgbs = np.random.uniform(size=(batch_size, 2, 16, 24, 3))
+    # Zero pixels are excluded, so the images have different pixel counts.
+    rgbs[1, 0, :4, :, 0] = 0.
+
+    histograms = self._eval(
+        ops.compute_chroma_histogram(tf.constant(rgbs, tf.float32), params))
+    self.assertEqual(histograms.shape, (batch_size, 2, 64, 64))
+    np.testing.assert_allclose(
+        np.sum(histograms, axis=(2, 3)), 1., rtol=1e-5)
+    for stream in range(2):
+      histogram = self._eval(
+          ops.compute_chroma_histogram(
+              tf.constant(rgbs[:, stream], tf.float32), params))
+      np.testing.assert_allclose(histograms[:, stream:stream + 1], histogram)
+
+  def testComputeChromaHistogramBinIndex(self):
+    """A single-color image should land in a single, known bin."""
+    first_bin = -0.5
+    bin_size = 1. / 32.
+    rgb = np.asarray([0.3, 0.5, 0.4])
+    u = np.log(rgb[1] / rgb[0])
+    v = np.log(rgb[1] / rgb[2])
+    # Both the power-of-two and the generic indexing paths.
+    for nbins in [48, 64]:
+      params = {'first_bin': first_bin, 'bin_size': bin_size, 'nbins': nbins}
+      histogram = self._eval(
+          ops.compute_chroma_histogram(
+              tf.constant(np.tile(rgb, [1, 4, 4, 1]), tf.float32), params))
+      expected = np.zeros((1, 1, nbins, nbins))
+      expected[0, 0,
+               int(np.round((u - first_bin) / bin_size)) % nbins,
+               int(np.round((v - first_bin) / bin_size)) % nbins] = 1.
+      np.testing.assert_allclose(histogram, expected)
+
   def testEvalFeaturesWithDeltaFunctions(self):
     """Tests EvalFeatures with delta functions.
 
@@ -53,18 +121,18 @@ class OpsTest(tf.test.TestCase):
     height = 3
     width = 3
     channels = 2
-    features = np.ones((batch_size, height, width, channels)) * 0.5
-    kernel = np.zeros((batch_size, height, width, channels))
-    kernel[:, 1, 1, 0] = 1.
+    features = np.ones((batch_size, channels, height, width)) * 0.5
+    kernel = np.zeros((batch_size, channels, height, width))
+    kernel[:, 0, 1, 1] = 1.
     kernel[:, 1, 1, 1] = 1.
-    kernel_fft = ops.r2c_fft2(tf.constant(kernel, tf.float32))
+    kernel_fft = ops.r2c_rfft2(tf.constant(kernel, tf.float32))
 
     bias = np.random.uniform(size=(batch_size, height, width))
     h = np.asarray(
         self._eval(
             ops.eval_features(
                 tf.constant(features, dtype=tf.float32), kernel_fft, bias)))
-    np.testing.assert_allclose(h, np.sum(features, axis=-1) + bias)
+    np.testing.assert_allclose(h, np.sum(features, axis=1) + bias)
 
   def testEvalFeaturesWithCircularConv2(self):
     """Tests EvalFeatures with 2D circular convolution.
@@ -76,9 +144,9 @@ class OpsTest(tf.test.TestCase):
     batch_size = 2
     height = 3
     width = 3
-    features = np.random.uniform(size=(batch_size, height, width, 1))
-    kernel = np.random.uniform(size=(batch_size, height, width, 1))
-    kernel_fft = ops.r2c_fft2(tf.constant(kernel, tf.float32))
+    features = np.random.uniform(size=(batch_size, 1, height, width))
+    kernel = np.random.uniform(size=(batch_size, 1, height, width))
+    kernel_fft = ops.r2c_rfft2(tf.constant(kernel, tf.float32))
     zero_bias = np.zeros((batch_size, height, width))
     h = np.asarray(
         self._eval(
@@ -95,6 +163,33 @@ class OpsTest(tf.test.TestCase):
       np.testing.assert_allclose(
           h[i, :, :], h_ref[:height, :width], rtol=1e-05, atol=1e-07)
 
+  def testEvalFeaturesFft(self):
+    """Tests that EvalFeaturesFft on precomputed features matches EvalFeatures.
+
+    The same features FFT is reused against several filters, with an odd width
+    so that the width has to be recovered from the bias.
+    """
+    batch_size = 2
+    channels = 2
+    height = 4
+    width = 5
+    features = tf.constant(
+        np.random.uniform(size=(batch_size, channels, height, width)),
+        dtype=tf.float32)
+    bias = np.random.uniform(size=(batch_size, height, width))
+    features_fft = ops.precompute_features_fft(features)
+    for _ in range(2):
+      kernel_fft = ops.r2c_rfft2(
+          tf.constant(
+              np.random.uniform(size=(batch_size, channels, height, width)),
+              dtype=tf.float32))
+      h_fft, h = self._eval([
+          ops.eval_features_fft(features_fft, kernel_fft, bias),
+          ops.eval_features(features, kernel_fft, bias)
+      ])
+      self.assertEqual(np.asarray(h_fft).shape, (batch_size, height, width))
+      np.testing.assert_allclose(h_fft, h, rtol=1e-05, atol=1e-06)
+
   def testSoftmax2(self):
     """Check the simple 2D case where are dimensions are softmax'ed."""
     batch_size = 2
@@ -183,7 +278,7 @@ class OpsTest(tf.test.TestCase):
     xs = np.asarray([0.5, 1, 1.5, 2, 2.5, 4, 4.5, 8, 8.5])
     bins = np.asarray([1, 2, 4, 8])
 
-    f = ops.splat_non_uniform(xs, bins)
+    f = self._eval(ops.splat_non_uniform(xs, bins))
 
     # Checks expected result
     # pyformat: disable
@@ -203,8 +298,16 @@ class OpsTest(tf.test.TestCase):
     # Random xs that are within the range.
     batch_size = 5
     xs = np.random.uniform(low=bins[0], high=bins[-1], size=(batch_size))
-    f = ops.splat_non_uniform(xs, bins)
-    np.testing.assert_allclose(xs, np.sum(f * bins[np.newaxis, :], axis=1))
+    f = self._eval(ops.splat_non_uniform(xs, bins))
+    np.testing.assert_allclose(
+        xs, np.sum(f * bins[np.newaxis, :], axis=1), rtol=1e-06)
+    # Each x is interpolated between the two bins around it, so no weight is
+    # negative.
+    self.assertGreaterEqual(np.min(f), 0.)
+
+    # An x that is not bracketed by the two bins nearest to it.
+    f = self._eval(ops.splat_non_uniform(np.asarray([3.5]), bins))
+    np.testing.assert_allclose(f, np.asarray([[0, 0.25, 0.75, 0]]))
 
   def testUvToPmf(self):
     offset = 0.5